@@ -0,0 +1,132 @@
+""" HTTP interface to the simulations, served alongside the Bokeh application.
+
+    POST /api/<experiment> with a JSON object mapping parameter names to values
+    (in the unit of the controls; missing parameters use their default). The
+    results are returned as a JSON object, or, with ?array=<name>, as the raw
+    little-endian float64 data of a single result, its shape being given by the
+    X-Shape header. The accuracy tier is selected with ?tier=<tier>.
+    GET /api/<experiment> returns the default parameters.
+    
+    GET /api/metrics returns the memory usage of the sessions and of the cache.
+
+    Concurrent requests for the same experiment received within a short window
+    are simulated together, and the results are shared with the web pages
+    through the cache of the simulation module.
+"""
+
+import asyncio
+import json
+import os
+
+import numpy
+import tornado.ioloop
+import tornado.web
+
+import sessions
+import simulation
+
+# Duration during which concurrent requests are grouped, in seconds
+batch_window = float(os.environ.get("SYCOMORE_BATCH_WINDOW", 0.01))
+
+class Batcher(object):
+    """ Group the configurations of concurrent requests for an experiment and
+        simulate them in a single call
+    """
+
+    def __init__(self, experiment, tier):
+        self.experiment = experiment
+        self.tier = tier
+        self._pending = []
+
+    def submit(self, values):
+        """ Return a future holding the results of the configuration
+        """
+
+        future = asyncio.get_event_loop().create_future()
+        if not self._pending:
+            tornado.ioloop.IOLoop.current().call_later(
+                batch_window, self._flush)
+        self._pending.append((values, future))
+        return future
+
+    async def _flush(self):
+        pending, self._pending = self._pending, []
+        loop = tornado.ioloop.IOLoop.current()
+        try:
+            results = await loop.run_in_executor(
+                None, simulation.compute_many,
+                self.experiment, [x[0] for x in pending], self.tier, False)
+        except Exception:
+            # Simulate each configuration on its own, so that a failing
+            # configuration only fails its own request
+            results = await asyncio.gather(
+                *[
+                    loop.run_in_executor(
+                        None, simulation.compute,
+                        self.experiment, values, self.tier, False)
+                    for values, _ in pending],
+                return_exceptions=True)
+        for (_, future), result in zip(pending, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+_batchers = {}
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.write(sessions.get_metrics())
+
+class ExperimentHandler(tornado.web.RequestHandler):
+    def get(self, experiment):
+        module = self._get_experiment(experiment)
+        self.write({
+            "experiment": experiment,
+            "parameters": {
+                name: default
+                for name, (default, _) in module.parameters.items()}})
+
+    async def post(self, experiment):
+        self._get_experiment(experiment)
+        try:
+            values = json.loads(self.request.body or b"{}")
+            if not isinstance(values, dict):
+                raise ValueError("Parameters must be a JSON object")
+            values = simulation.check_values(experiment, values)
+            tier = simulation.get_tier(
+                experiment, self.get_argument("tier", None))
+        except ValueError as e:
+            raise tornado.web.HTTPError(400, reason=str(e))
+
+        if (experiment, tier) not in _batchers:
+            _batchers[experiment, tier] = Batcher(experiment, tier)
+        results = await _batchers[experiment, tier].submit(values)
+
+        array = self.get_argument("array", None)
+        if array is None:
+            self.write({
+                "experiment": experiment, "tier": tier, "parameters": values,
+                "results": {
+                    name: numpy.asarray(x).tolist()
+                    for name, x in results.items()}})
+        elif array in results:
+            data = numpy.asarray(results[array], "<f8")
+            self.set_header("Content-Type", "application/octet-stream")
+            self.set_header("X-Shape", ",".join(str(x) for x in data.shape))
+            self.set_header("X-Dtype", data.dtype.str)
+            self.write(data.tobytes())
+        else:
+            raise tornado.web.HTTPError(
+                400, reason="Unknown result: {}".format(array))
+
+    def _get_experiment(self, experiment):
+        try:
+            return simulation.get_experiment(experiment)
+        except KeyError:
+            raise tornado.web.HTTPError(
+                404, reason="Unknown experiment: {}".format(experiment))
+
+patterns = [
+    (r"/api/metrics", MetricsHandler),
+    (r"/api/(\w+)", ExperimentHandler)]
@@ -0,0 +1,98 @@
+""" Query the HTTP API of a running server, e.g.
+
+        python api_client.py rare -p T1=800 -p TE=100
+        python api_client.py rare -p T1=800 --array magnitude
+        python api_client.py se_contrast --concurrent 8
+
+    With --concurrent, several requests with different parameters are sent at
+    once, so that they are simulated in a single batch by the server.
+"""
+
+import argparse
+import concurrent.futures
+import json
+import time
+import urllib.parse
+import urllib.request
+
+import numpy
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("experiment")
+    parser.add_argument(
+        "--parameter", "-p", action="append", default=[], dest="parameters",
+        metavar="NAME=VALUE")
+    parser.add_argument("--tier", "-t", help="Accuracy tier")
+    parser.add_argument(
+        "--array", "-a", help="Request a single result as binary data")
+    parser.add_argument(
+        "--concurrent", "-c", type=int, default=1,
+        help="Number of concurrent requests, with the first parameter of the "
+            "experiment shifted by one unit between requests")
+    parser.add_argument("--url", default="http://localhost:5006")
+    arguments = parser.parse_args()
+
+    values = {}
+    for parameter in arguments.parameters:
+        name, _, value = parameter.partition("=")
+        values[name] = float(value)
+
+    if arguments.concurrent > 1:
+        defaults = request(arguments.url, arguments.experiment)["parameters"]
+        name = next(iter(defaults))
+        configurations = [
+            dict(values, **{name: values.get(name, defaults[name])+index})
+            for index in range(arguments.concurrent)]
+    else:
+        configurations = [values]
+
+    start = time.time()
+    with concurrent.futures.ThreadPoolExecutor(len(configurations)) as executor:
+        responses = list(executor.map(
+            lambda x: request(
+                arguments.url, arguments.experiment, x, arguments.tier,
+                arguments.array),
+            configurations))
+    stop = time.time()
+
+    for response in responses:
+        if arguments.array is None:
+            print(json.dumps(response["parameters"]))
+            for name, value in response["results"].items():
+                print("  {}: {}".format(name, numpy.shape(value)))
+        else:
+            print("{}: {}".format(arguments.array, response.shape))
+    print("{} request(s) in {:.3f} s".format(len(responses), stop-start))
+
+def request(url, experiment, values=None, tier=None, array=None):
+    """ Query the API: return the default parameters if no values are given,
+        the results as a dictionary if no array is given, or the array.
+    """
+
+    url = "{}/api/{}".format(url.rstrip("/"), experiment)
+    if values is None:
+        with urllib.request.urlopen(url) as response:
+            return json.load(response)
+
+    query = {
+        name: value for name, value in [("tier", tier), ("array", array)]
+        if value is not None}
+    if query:
+        url += "?{}".format(urllib.parse.urlencode(query))
+    data = json.dumps(values).encode()
+    with urllib.request.urlopen(
+            urllib.request.Request(
+                url, data, {"Content-Type": "application/json"})) as response:
+        if array is None:
+            return json.load(response)
+        else:
+            shape = [
+                int(x) for x in response.headers["X-Shape"].split(",") if x]
+            return numpy.frombuffer(
+                response.read(), response.headers["X-Dtype"]).reshape(shape)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+""" Run an experiment on a grid of parameters, outside of the web application.
+
+    The grid is the cartesian product of the values of each parameter; missing
+    parameters use the default of the experiment. Parameters are expressed in
+    the unit of the controls of the web application, e.g.
+
+        python batch.py rare -p T1=400:1200:9 -p TE=100,200 -o rare_grid
+
+    The configurations are split in chunks which are simulated in a pool of
+    processes. Each chunk is saved as soon as it is done: running the same
+    command again resumes the computation, skipping the saved chunks. The
+    chunks are finally merged in a single NPZ or Parquet file.
+"""
+
+import argparse
+import importlib.util
+import itertools
+import json
+import multiprocessing
+import os
+import pathlib
+import sys
+import time
+
+import numpy
+
+import simulation
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("experiment", choices=simulation.experiments)
+    parser.add_argument(
+        "--parameter", "-p", action="append", default=[], dest="parameters",
+        metavar="NAME=VALUES",
+        help="Values of a parameter, either as a comma-separated list or as "
+            "start:stop:count")
+    parser.add_argument(
+        "--grid", "-g", type=pathlib.Path,
+        help="JSON file mapping parameter names to lists of values")
+    parser.add_argument(
+        "--tier", "-t", choices=simulation.tiers,
+        help="Accuracy tier, for the experiments which define tiers "
+            "(default: {})".format(simulation.default_tier))
+    parser.add_argument(
+        "--output", "-o", type=pathlib.Path, required=True,
+        help="Output directory, holding the chunks and the merged results")
+    parser.add_argument(
+        "--processes", "-j", type=int, default=os.cpu_count(),
+        help="Number of worker processes (default: %(default)s)")
+    parser.add_argument(
+        "--chunk-size", "-c", type=int, default=16,
+        help="Number of configurations per chunk (default: %(default)s)")
+    parser.add_argument(
+        "--format", "-f", choices=["npz", "parquet"], default="npz",
+        help="Format of the merged results (default: %(default)s)")
+    arguments = parser.parse_args()
+
+    try:
+        grid = {}
+        if arguments.grid is not None:
+            grid.update(json.loads(arguments.grid.read_text()))
+        for parameter in arguments.parameters:
+            name, _, values = parameter.partition("=")
+            grid[name] = parse_values(values)
+
+        if arguments.format == "parquet":
+            check_parquet()
+
+        tier = simulation.get_tier(arguments.experiment, arguments.tier)
+        configurations = get_configurations(arguments.experiment, grid)
+        run(
+            arguments.experiment, tier, grid, configurations, arguments.output,
+            arguments.processes, arguments.chunk_size)
+    except (ValueError, KeyError) as e:
+        parser.error(str(e))
+
+    merge = {"npz": merge_npz, "parquet": merge_parquet}[arguments.format]
+    path = merge(arguments.output, len(configurations), arguments.chunk_size)
+    print("Results saved to {}".format(path), file=sys.stderr)
+
+def parse_values(values):
+    """ Parse a comma-separated list of values or a start:stop:count range
+    """
+
+    if ":" in values:
+        start, stop, count = values.split(":")
+        return numpy.linspace(float(start), float(stop), int(count)).tolist()
+    else:
+        return [parse_value(x) for x in values.split(",")]
+
+def parse_value(value):
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+def get_configurations(experiment, grid):
+    """ Return the list of configurations (i.e. values of all parameters) of
+        the grid
+    """
+
+    module = simulation.get_experiment(experiment)
+    unknown = set(grid) - set(module.parameters)
+    if unknown:
+        raise ValueError(
+            "Unknown parameters for {}: {}".format(
+                experiment, ", ".join(sorted(unknown))))
+
+    names = list(module.parameters)
+    values = [grid.get(name, [module.parameters[name][0]]) for name in names]
+    return [dict(zip(names, x)) for x in itertools.product(*values)]
+
+def run(
+        experiment, tier, grid, configurations, directory, processes, 
+        chunk_size):
+    """ Simulate the missing chunks of configurations and save them in the
+        directory
+    """
+
+    (directory/"chunks").mkdir(parents=True, exist_ok=True)
+
+    # Refuse to resume a different computation
+    metadata = {
+        "experiment": experiment, "tier": tier, "grid": grid, 
+        "chunk_size": chunk_size}
+    metadata_path = directory/"grid.json"
+    if metadata_path.exists():
+        if json.loads(metadata_path.read_text()) != metadata:
+            raise ValueError(
+                "{} holds the results of a different grid".format(directory))
+    else:
+        metadata_path.write_text(json.dumps(metadata, indent=4))
+
+    chunks = [
+        (experiment, tier, index, configurations[start:start+chunk_size])
+        for index, start in enumerate(
+            range(0, len(configurations), chunk_size))]
+    missing = [x for x in chunks if not get_chunk_path(directory, x[2]).exists()]
+    print(
+        "{} configurations, {} chunks, {} to compute".format(
+            len(configurations), len(chunks), len(missing)),
+        file=sys.stderr)
+
+    start = time.time()
+    with multiprocessing.Pool(processes) as pool:
+        for done, (index, chunk_configurations, results) in enumerate(
+                pool.imap_unordered(simulate_chunk, missing)):
+            save_chunk(
+                get_chunk_path(directory, index),
+                chunk_configurations, results)
+            print(
+                "Chunk {} done ({}/{}, {:.1f} s)".format(
+                    index, 1+done, len(missing), time.time()-start),
+                file=sys.stderr)
+
+def simulate_chunk(chunk):
+    experiment, tier, index, configurations = chunk
+    results = [
+        simulation.run(experiment, configuration, tier)
+        for configuration in configurations]
+    return index, configurations, results
+
+def get_chunk_path(directory, index):
+    return directory/"chunks"/"{:06d}.npz".format(index)
+
+def save_chunk(path, configurations, results):
+    """ Save the parameters and the results of a chunk. The file is written
+        atomically, so that an interrupted run never leaves a partial chunk.
+    """
+
+    arrays = {}
+    for name in configurations[0]:
+        arrays["parameters.{}".format(name)] = numpy.array(
+            [x[name] for x in configurations])
+    for name in results[0]:
+        arrays["results.{}".format(name)] = stack([x[name] for x in results])
+
+    temporary_path = path.with_suffix(".tmp")
+    with temporary_path.open("wb") as fd:
+        numpy.savez(fd, **arrays)
+    temporary_path.replace(path)
+
+def stack(arrays):
+    """ Stack arrays of identical shape, or store arrays of different shapes
+        (e.g. variable number of repetitions) in an array of objects
+    """
+
+    arrays = [numpy.asarray(x) for x in arrays]
+    if all(x.shape == arrays[0].shape for x in arrays):
+        return numpy.stack(arrays)
+    else:
+        result = numpy.empty(len(arrays), object)
+        for index, array in enumerate(arrays):
+            result[index] = array
+        return result
+
+def load_chunks(directory, configurations_count, chunk_size):
+    chunks_count = (configurations_count+chunk_size-1)//chunk_size
+    for index in range(chunks_count):
+        with numpy.load(
+                get_chunk_path(directory, index), allow_pickle=True) as chunk:
+            yield {name: chunk[name] for name in chunk.files}
+
+def merge_npz(directory, configurations_count, chunk_size):
+    merged = {}
+    for chunk in load_chunks(directory, configurations_count, chunk_size):
+        for name, array in chunk.items():
+            merged.setdefault(name, []).extend(array)
+
+    path = directory/"results.npz"
+    numpy.savez(path, **{name: stack(x) for name, x in merged.items()})
+    return path
+
+def check_parquet():
+    """ Check that the dependencies of the Parquet output are available before
+        running the simulations
+    """
+
+    missing = [
+        x for x in ["pandas", "pyarrow"]
+        if importlib.util.find_spec(x) is None]
+    if missing:
+        raise ValueError(
+            "Parquet output requires {}".format(", ".join(missing)))
+
+def merge_parquet(directory, configurations_count, chunk_size):
+    try:
+        import pandas
+    except ImportError:
+        raise RuntimeError("Parquet output requires pandas and pyarrow")
+
+    frames = []
+    for chunk in load_chunks(directory, configurations_count, chunk_size):
+        frames.append(pandas.DataFrame(
+            {name: list(array) for name, array in chunk.items()}))
+
+    path = directory/"results.parquet"
+    pandas.concat(frames, ignore_index=True).to_parquet(path)
+    return path
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+""" Measure the latency of the updates under concurrent sessions.
+
+    Start a local server (serve.py), open a number of sessions spread over the
+    experiments, and replay slider changes in each session: a slider is picked
+    at random and moved around its current value, after a random think time.
+    For each change, the latency until the first result (possibly a draft) and
+    until the final result is recorded, while the CPU usage and the memory of
+    the server are sampled. Requires psutil.
+
+        python loadtest.py --users 16 --changes 20 --report report.json
+
+    The generated traces can be saved and replayed, e.g. to compare two
+    versions of the server under the same load.
+"""
+
+import argparse
+import json
+import multiprocessing
+import pathlib
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import bokeh.client
+import bokeh.document.events
+import bokeh.models
+import numpy
+import psutil
+
+import serve
+import simulation
+
+here = pathlib.Path(__file__).parent
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--users", "-u", type=int, default=8,
+        help="Number of concurrent sessions (default: %(default)s)")
+    parser.add_argument(
+        "--experiments", "-e", nargs="+", default=simulation.experiments,
+        choices=simulation.experiments,
+        help="Experiments of the sessions, assigned in turn (default: all)")
+    parser.add_argument(
+        "--changes", "-c", type=int, default=20,
+        help="Number of slider changes per session (default: %(default)s)")
+    parser.add_argument(
+        "--think-time", "-t", type=float, default=1,
+        help="Mean time between two changes, in seconds (default: "
+            "%(default)s)")
+    parser.add_argument(
+        "--ramp-up", type=float, default=5,
+        help="Duration over which the sessions are opened, in seconds "
+            "(default: %(default)s)")
+    parser.add_argument(
+        "--timeout", type=float, default=120,
+        help="Maximum duration of an update, in seconds (default: "
+            "%(default)s)")
+    parser.add_argument(
+        "--sampling-period", type=float, default=0.5,
+        help="Period of the CPU and memory samples, in seconds (default: "
+            "%(default)s)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--traces", type=pathlib.Path,
+        help="Replay the traces saved by a previous run")
+    parser.add_argument(
+        "--save-traces", type=pathlib.Path,
+        help="Save the replayed traces")
+    parser.add_argument(
+        "--report", "-r", type=pathlib.Path,
+        help="Save the latencies and the resource samples as JSON")
+    parser.add_argument(
+        "--server-log", type=pathlib.Path,
+        help="Save the output of the server")
+    arguments = parser.parse_args()
+
+    if arguments.traces is not None:
+        traces = json.loads(arguments.traces.read_text())
+    else:
+        traces = [None]*arguments.users
+    users = [
+        (
+            arguments.experiments[index % len(arguments.experiments)]
+                if trace is None else trace["experiment"],
+            trace)
+        for index, trace in enumerate(traces)]
+
+    port = get_free_port()
+    url = "http://localhost:{}/".format(port)
+    log = (
+        arguments.server_log.open("w") if arguments.server_log is not None
+        else subprocess.DEVNULL)
+    server = subprocess.Popen(
+        [sys.executable, "serve.py", "--port", str(port)],
+        cwd=here, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        wait_for_server(url, server)
+
+        monitor = Monitor(server.pid, arguments.sampling_period)
+        monitor.start()
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(len(users)) as pool:
+            results = pool.starmap(
+                run_session,
+                [
+                    (
+                        url, experiment, trace, arguments.changes,
+                        arguments.think_time, arguments.timeout,
+                        arguments.seed+index,
+                        index*arguments.ramp_up/len(users))
+                    for index, (experiment, trace) in enumerate(users)])
+        monitor.stop()
+    finally:
+        server.terminate()
+        server.wait()
+
+    print_report(results, monitor.samples)
+
+    if arguments.save_traces is not None:
+        arguments.save_traces.write_text(json.dumps(
+            [
+                {"experiment": x["experiment"], "events": x["events"]}
+                for x in results],
+            indent=4))
+    if arguments.report is not None:
+        arguments.report.write_text(json.dumps(
+            {"sessions": results, "samples": monitor.samples}, indent=4))
+
+def get_free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+def wait_for_server(url, server, timeout=60):
+    start = time.time()
+    while time.time()-start < timeout:
+        if server.poll() is not None:
+            raise RuntimeError(
+                "Server exited with code {}".format(server.poll()))
+        try:
+            urllib.request.urlopen(
+                "{}api/{}".format(url, simulation.experiments[0]))
+        except OSError:
+            time.sleep(0.2)
+        else:
+            return
+    raise RuntimeError("Server did not start within {} s".format(timeout))
+
+class Monitor(object):
+    """ Sample the CPU usage and the memory of a process and of its children
+        (i.e. the simulation workers) in a background thread
+    """
+
+    def __init__(self, pid, period):
+        self.process = psutil.Process(pid)
+        self.period = period
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        start = time.time()
+        processes = {}
+        while not self._stop.wait(self.period):
+            cpu, rss = 0, 0
+            try:
+                children = self.process.children(recursive=True)
+            except psutil.NoSuchProcess:
+                break
+            for process in [self.process]+children:
+                # CPU usage is measured since the previous call for the same
+                # process object: keep the objects between samples
+                process = processes.setdefault(process.pid, process)
+                try:
+                    cpu += process.cpu_percent()
+                    rss += process.memory_info().rss
+                except psutil.NoSuchProcess:
+                    pass
+            self.samples.append({
+                "time": time.time()-start, "cpu": cpu, "rss": rss,
+                "processes": 1+len(children)})
+
+def run_session(
+        url, experiment, trace, changes, think_time, timeout, seed, delay):
+    """ Open a session and replay a trace, or a random trace if none is given.
+        Return the replayed events and their latencies.
+    """
+
+    time.sleep(delay)
+
+    random_ = random.Random(seed)
+    session = bokeh.client.pull_session(
+        url=url+serve.route.lstrip("/"), arguments={"e": experiment})
+    document = session.document
+
+    # Record the times at which the runtime is tagged with a new update
+    updates = []
+    def on_change(event):
+        if (
+                isinstance(event, bokeh.document.events.ModelChangedEvent)
+                and event.model.id == "runtime" and event.attr == "tags"):
+            updates.append((time.perf_counter(), event.new[1]))
+    document.on_change(on_change)
+
+    if trace is None:
+        events = []
+        sliders = list(document.select({"type": bokeh.models.Slider}))
+        # Each change starts from the previous value of the slider
+        values = {x.id: x.value for x in sliders}
+        for _ in range(changes):
+            slider = random_.choice(sliders)
+            values[slider.id] = get_next_value(
+                slider, values[slider.id], random_)
+            events.append({
+                "delay": random_.expovariate(1/think_time),
+                "control": slider.id, "value": values[slider.id]})
+    else:
+        events = trace["events"]
+
+    latencies = []
+    for event in events:
+        time.sleep(event["delay"])
+        slider = document.get_model_by_id(event["control"])
+        if slider.value == event["value"]:
+            latencies.append(None)
+            continue
+
+        del updates[:]
+        start = time.perf_counter()
+        slider.value = event["value"]
+        # Simulate the end of a drag, which triggers the update on the server
+        slider.set_from_json("value_throttled", event["value"])
+
+        while (
+                not any(final for _, final in updates)
+                and time.perf_counter()-start < timeout):
+            session.force_roundtrip()
+            time.sleep(0.02)
+
+        final = [x for x, final in updates if final]
+        latencies.append({
+            "first": updates[0][0]-start if updates else None,
+            "final": final[0]-start if final else None})
+
+    session.close()
+
+    return {"experiment": experiment, "events": events, "latencies": latencies}
+
+def get_next_value(slider, current, random_):
+    """ Move a slider around its current value, as a user would
+    """
+
+    span = slider.end-slider.start
+    while True:
+        value = current + random_.gauss(0, 0.1*span)
+        steps = round((value-slider.start)/slider.step)
+        value = slider.start + steps*slider.step
+        value = min(max(value, slider.start), slider.end)
+        if value != current:
+            return value
+
+def print_report(results, samples):
+    print("Latency (s)       count    p50    p90    p99    max  timeouts")
+    experiments = sorted(set(x["experiment"] for x in results))
+    for experiment in experiments+[None]:
+        latencies = [
+            latency
+            for x in results if experiment in [None, x["experiment"]]
+            for latency in x["latencies"] if latency is not None]
+        if not latencies:
+            continue
+        for kind in ["first", "final"]:
+            values = [x[kind] for x in latencies if x[kind] is not None]
+            # Keep the row of the updates which all timed out
+            statistics = (
+                [
+                    "{:.3f}".format(x) for x in
+                    [*numpy.percentile(values, [50, 90, 99]), max(values)]]
+                if values else ["-"]*4)
+            print(
+                "{:<24} {:>5} {:>6} {:>6} {:>6} {:>6} {:>9}".format(
+                    "{} ({})".format(experiment or "all", kind)[:24],
+                    len(values), *statistics, len(latencies)-len(values)))
+
+    if samples:
+        cpu = [x["cpu"] for x in samples]
+        rss = [x["rss"]/2**20 for x in samples]
+        print()
+        print(
+            "Server CPU (%): mean {:.0f}, max {:.0f}".format(
+                numpy.mean(cpu), max(cpu)))
+        print(
+            "Server RSS (MiB): start {:.0f}, max {:.0f}, end {:.0f}".format(
+                rss[0], max(rss), rss[-1]))
+        
+        print()
+        print("Time (s)  CPU (%)  RSS (MiB)  Processes")
+        for sample in samples[::max(1, len(samples)//20)]:
+            print(
+                "{:>8.1f} {:>8.0f} {:>10.0f} {:>10}".format(
+                    sample["time"], sample["cpu"], sample["rss"]/2**20,
+                    sample["processes"]))
+
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,13 @@ import bokeh.models
 import bokeh.plotting
 
 import home
+import profiling
 import rare
 import rf_spoiling_evolution
 import rf_spoiling_efficiency
 import se_contrast
+import sessions
+import simulation
 import slice_profile
 
 experiments = collections.OrderedDict(
@@ -21,6 +24,8 @@ experiments = collections.OrderedDict(
 
 arguments = bokeh.plotting.curdoc().session_context.request.arguments
 experiment = arguments.get("e", [b"home"])[0].decode()
+profiles = arguments.get("profile", [b"0"])[0].decode()
+profiles = int(profiles) if profiles.isdigit() else 0
 
 if experiment in experiments:
     contents = experiments[experiment].create_contents()
@@ -38,3 +43,16 @@ bokeh.plotting.curdoc().title = title
 
 if experiment is not None:
     experiments[experiment].init()
+    
+    if experiment in simulation.experiments:
+        sessions.watch_activity(
+            bokeh.plotting.curdoc(), experiment, experiments[experiment].update)
+    
+    # Profile the next updates, i.e. the ones triggered by the user
+    if profiles > 0 and experiment in simulation.experiments:
+        if profiling.directory is None:
+            profiling.logger.warning(
+                "Profiling requested, but SYCOMORE_PROFILE_DIRECTORY is not set")
+        else:
+            sessions.get_session(
+                bokeh.plotting.curdoc(), experiment).profiles = profiles
@@ -0,0 +1,111 @@
+""" Profile the simulation of an experiment.
+
+    Pages opened with ?profile=N profile their next N updates, if the
+    SYCOMORE_PROFILE_DIRECTORY environment variable is set. Each profile is
+    saved in that directory as a cProfile dump (.prof, which can be converted
+    to a flame graph, e.g. with flameprof, or explored with snakeviz), a
+    summary of the top functions (.txt) and the parameters of the simulation
+    (.json). The same simulation can then be profiled offline:
+
+        python profiling.py profiles/rare-20240101-120000-1234-0.json -r 5
+"""
+
+import argparse
+import cProfile
+import io
+import itertools
+import json
+import logging
+import os
+import pathlib
+import pstats
+import time
+
+import simulation
+
+# Directory of the profiles, profiling is disabled if not set
+directory = os.environ.get("SYCOMORE_PROFILE_DIRECTORY")
+
+# Number of functions listed in the summary
+top_count = 30
+
+logger = logging.getLogger(__name__)
+
+_counter = itertools.count()
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "parameters", type=pathlib.Path,
+        help="Parameters of a profile saved by the server")
+    parser.add_argument(
+        "--output", "-o", type=pathlib.Path, default=pathlib.Path("."),
+        help="Output directory (default: current directory)")
+    parser.add_argument(
+        "--repeat", "-r", type=int, default=1,
+        help="Number of simulations to time before profiling")
+    arguments = parser.parse_args()
+
+    metadata = json.loads(arguments.parameters.read_text())
+    experiment, values, tier = [
+        metadata[x] for x in ["experiment", "parameters", "tier"]]
+
+    durations = []
+    for _ in range(arguments.repeat):
+        start = time.perf_counter()
+        simulation.run(experiment, values, tier)
+        durations.append(time.perf_counter()-start)
+    print(
+        "Runtime: min {:.3f} s, median {:.3f} s over {} run(s)".format(
+            min(durations), sorted(durations)[len(durations)//2],
+            len(durations)))
+
+    arguments.output.mkdir(parents=True, exist_ok=True)
+    path = profile(experiment, values, tier, arguments.output)[1]
+    print(path.with_suffix(".txt").read_text())
+
+def profile(experiment, values, tier, directory):
+    """ Simulate an experiment (without using the cache) under a profiler,
+        save the profile and return the results and the path of the dump
+    """
+
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    results = profiler.runcall(simulation.run, experiment, values, tier)
+    duration = time.perf_counter()-start
+
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory/"{}-{}-{}-{}.prof".format(
+        experiment, time.strftime("%Y%m%d-%H%M%S"), os.getpid(), 
+        next(_counter))
+    profiler.dump_stats(path)
+
+    summary = io.StringIO()
+    statistics = pstats.Stats(profiler, stream=summary)
+    # Functions by own time (the hotspots), then by cumulative time (their
+    # callers)
+    for order in ["tottime", "cumulative"]:
+        statistics.sort_stats(order).print_stats(top_count)
+    path.with_suffix(".txt").write_text(summary.getvalue())
+
+    metadata = {
+        "experiment": experiment,
+        "tier": simulation.get_tier(experiment, tier),
+        "parameters": simulation.get_values(experiment, values),
+        "duration": duration}
+    path.with_suffix(".json").write_text(json.dumps(metadata, indent=4))
+
+    # Logged at INFO level, which serve.py enables by default
+    logger.info(
+        "Profiled %s (tier %s, %.3f s) with %s: %s",
+        experiment, metadata["tier"], duration,
+        ", ".join("{}={}".format(*x) for x in metadata["parameters"].items()),
+        path)
+
+    return results, path
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,3 @@
-import time
-
 import bokeh.layouts
 import bokeh.models
 import bokeh.plotting
@@ -7,12 +5,41 @@ import numpy
 import sycomore
 from sycomore.units import *
 
-import utils
+import sessions
 
 title = "RARE"
 
 time_step = 5*ms
 
+# Simulation parameters: default value and unit of the controls
+parameters = {
+    "T1": (600, ms), "T2": (400, ms),
+    "excitation": (90, deg), "TE": (200, ms), "refocalization": (180, deg),
+    "train_length": (3, 1), "TR": (1000, ms), "repetitions": (4, 1),
+}
+
+# Range of the controls: start, end and whether the values are integers
+ranges = {
+    "T1": (0, 2000, False), "T2": (0, 2000, False),
+    "excitation": (0, 180, False), "TE": (0, 2000, False),
+    "refocalization": (0, 180, False), "train_length": (1, 10, True),
+    "TR": (0, 2000, False), "repetitions": (1, 10, True),
+}
+
+# Accuracy tiers: time step and number of positions of the simulation. The
+# time step must divide TE/2, i.e. the step of the TE slider divided by 2.
+tiers = {
+    "draft": {"time_step": time_step, "positions_count": 96},
+    "standard": {"time_step": time_step},
+    "precise": {"time_step": 0.5*ms},
+}
+
+# Number of steps whose magnetization is stored before being reduced
+chunk_size = 1000
+
+# Curves of the pinned configurations: figure, results used as x and y
+overlays = [("magnitude_plot", "times", "magnitude")]
+
 def create_contents():
     # Species controls
     T1 = bokeh.models.Slider(
@@ -86,6 +113,8 @@ def create_contents():
             bokeh.models.Div(text="Sequence", css_classes=["group-title"]),
             excitation, TE, refocalization, train_length, TR, repetitions,
             css_classes=["box"]),
+        sessions.create_accuracy_controls(update),
+        sessions.create_comparison_controls(__name__, [magnitude_plot]),
         bokeh.models.Div(id="runtime", text="Runtime: ", align="start"),
         width=320, height=250,
         sizing_mode="fixed")
@@ -96,33 +125,29 @@ def create_contents():
         sizing_mode="scale_both")
 
 def update():
-    start = time.time()
-    
-    document = bokeh.plotting.curdoc()
-    
-    T1 = document.get_model_by_id("T1").value*ms
-    T2 = document.get_model_by_id("T2").value*ms
-    
-    excitation = document.get_model_by_id("excitation").value*deg
-    TE = document.get_model_by_id("TE").value*ms
-    refocalization = document.get_model_by_id("refocalization").value*deg
-    train_length = document.get_model_by_id("train_length").value
-    TR = document.get_model_by_id("TR").value*ms
-    repetitions = document.get_model_by_id("repetitions").value
+    sessions.update(__name__, display, 1)
+
+def display(document, result):
+    magnitude_data = document.get_model_by_id("magnitude_data")
+    magnitude_data.data = { "x": result["times"], "y": result["magnitude"] }
     
+    phase_data = document.get_model_by_id("phase_data")
+    phase_data.data = {
+        "x": result["times"], 
+        "y_min": result["phase_min"], "y_max": result["phase_max"] }
+
+def simulate(
+        T1, T2, excitation, TE, refocalization, train_length, TR, repetitions,
+        time_step=time_step, positions_count=192):
     species = sycomore.Species(T1, T2)
     
     m0 = [0., 0., 1., 1.]
     
     voxel_size = 1*mm
-    positions_count = 192
     
     steps = 1+int(repetitions*TR/time_step)
-    times_ms = numpy.linspace(0, (repetitions*TR).convert_to(ms), steps)
-
-    excitation = sycomore.bloch.pulse(excitation, 90*deg)
-    refocalization = sycomore.bloch.pulse(refocalization, 0*rad)
-        
+    times_ms = time_step.convert_to(ms)*numpy.arange(steps)
+    
     positions = sycomore.linspace(voxel_size, positions_count)
     gradient = (
         2*numpy.pi*rad/sycomore.gamma # T*s
@@ -134,48 +159,79 @@ def update():
             species, time_step, gradient_amplitude=gradient, position=position)
         for position in positions])
     
-    magnetizations = numpy.full((positions_count, steps, 4), m0)
-    # WARNING: floating-point modulo arithmetic is not reliable (pulses are
-    # missed). Switch to integer arithmetic in ms; this assumes that 
-    # time_step >= 2*ms.
-    TE_ms = int(numpy.round(TE.convert_to(ms)))
-    TR_ms = int(numpy.round(TR.convert_to(ms)))
-    for step, t in enumerate(times_ms[:-1]):
-        
-        t_in_TR = int(numpy.round(t)) % TR_ms
-        t_in_TE = t_in_TR % TE_ms
-        
-        if t_in_TR == 0 and step != len(times_ms)-1:
-            pulse = excitation
-        elif t_in_TE == TE_ms//2:
-            echo = (t_in_TR-TE_ms//2)//TE_ms
-            if echo < train_length:
-                pulse = refocalization
-            else:
-                pulse = numpy.identity(4)
-        else:
-            pulse = numpy.identity(4)
-        magnetizations[:,step+1] = numpy.einsum(
-            "ij,oj->oi", pulse, magnetizations[:,step])
-        magnetizations[:,step+1] = numpy.einsum(
-            "oij,oj->oi", time_intervals, magnetizations[:,step+1])
-    
-    signals = [m[:,0]+1j*m[:,1] for m in magnetizations]
-    phases = numpy.angle(signals)
-    
-    magnitude_data = document.get_model_by_id("magnitude_data")
-    magnitude_data.data = {
-        "x": times_ms, 
-        "y": numpy.abs(numpy.mean(signals, axis=0)) }
-    
-    phase_data = document.get_model_by_id("phase_data")
-    phase_data.data = {
-        "x": times_ms, 
-        "y_min": numpy.min(phases, axis=0), "y_max": numpy.max(phases, axis=0) }
+    # Propagators of each step, for each position: pulse (identity,
+    # excitation or refocalization, cf. get_schedule) followed by the time 
+    # interval.
+    pulses = numpy.asarray([
+        numpy.identity(4), 
+        sycomore.bloch.pulse(excitation, 90*deg),
+        sycomore.bloch.pulse(refocalization, 0*rad)])
+    propagators = numpy.einsum("oij,pjk->poik", time_intervals, pulses)
+    
+    schedule = get_schedule(
+        steps, time_step, TE, train_length, TR, repetitions)
+    
+    magnitude = numpy.empty(steps)
+    phase_min = numpy.empty(steps)
+    phase_max = numpy.empty(steps)
+    
+    # Store the transverse magnetization of a bounded number of steps, and
+    # reduce it to the magnitude and the phase range when the chunk is full
+    magnetization = numpy.full((positions_count, 4), m0)
+    transverse = numpy.empty((min(chunk_size, steps), positions_count, 2))
+    transverse[0] = magnetization[:, :2]
+    start, stored = 0, 1
+    for step, pulse in enumerate(schedule):
+        if stored == len(transverse):
+            reduce(transverse, magnitude, phase_min, phase_max, start)
+            start, stored = start+stored, 0
+        magnetization = numpy.einsum(
+            "oij,oj->oi", propagators[pulse], magnetization)
+        transverse[stored] = magnetization[:, :2]
+        stored += 1
+    reduce(transverse[:stored], magnitude, phase_min, phase_max, start)
+    
+    return {
+        "times": times_ms, "magnitude": magnitude,
+        "phase_min": phase_min, "phase_max": phase_max }
+
+def reduce(transverse, magnitude, phase_min, phase_max, start):
+    """ Store the magnitude of the mean signal and the range of the phases of
+        the steps following start
+    """
     
-    stop = time.time()
-    document.get_model_by_id("runtime").text = "Runtime: {}".format(
-        utils.to_eng_string(stop-start, "s", 1))
+    signals = transverse[..., 0]+1j*transverse[..., 1]
+    phases = numpy.angle(signals)
     
+    steps = slice(start, start+len(transverse))
+    magnitude[steps] = numpy.abs(numpy.mean(signals, axis=1))
+    phase_min[steps] = numpy.min(phases, axis=1)
+    phase_max[steps] = numpy.max(phases, axis=1)
+
+def get_schedule(steps, time_step, TE, train_length, TR, repetitions):
+    """ Return the pulse applied at the beginning of each step: 0 (none), 
+        1 (excitation) or 2 (refocalization).
+        
+        The event times are computed with integer arithmetic, in µs, and
+        assigned to the nearest step, so that no pulse is missed whatever the
+        time step.
+    """
+    
+    to_ticks = lambda x: int(numpy.round(1000*x.convert_to(ms)))
+    time_step, TE, TR = [to_ticks(x) for x in [time_step, TE, TR]]
+    
+    excitations = TR*numpy.arange(int(repetitions))
+    # Refocalizations in the middle of each echo, within the TR
+    echoes = TE//2 + TE*numpy.arange(int(train_length))
+    echoes = echoes[echoes < TR]
+    refocalizations = (excitations[:, None] + echoes).ravel()
+    
+    # No pulse is applied after the last step
+    schedule = numpy.zeros(steps-1, int)
+    for pulse, times in [(2, refocalizations), (1, excitations)]:
+        indices = (times + time_step//2) // time_step
+        schedule[indices[indices < len(schedule)]] = pulse
+    return schedule
+
 def init():
     update()
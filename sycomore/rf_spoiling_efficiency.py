@@ -1,5 +1,3 @@
-import time
-
 import bokeh.layouts
 import bokeh.models
 import bokeh.plotting
@@ -8,10 +6,46 @@ import sycomore
 from sycomore.units import *
 
 from rf_spoiling import *
+import sessions
 import utils
 
 title = "RF-Spoiling (efficiency)"
 
+# Simulation parameters: default value and unit of the controls
+parameters = {
+    "T1": (1000, ms), "T2": (1000, ms),
+    "flip_angle": (30, deg), "TE": (5, ms), "TR": (25, ms),
+}
+
+# Range of the controls: start, end and whether the values are integers
+ranges = {
+    "T1": (0, 2000, False), "T2": (0, 2000, False),
+    "flip_angle": (0, 90, False), "TE": (0, 2000, False),
+    "TR": (0, 2000, False),
+}
+
+# Accuracy tiers: threshold of the EPG model, number of phase steps of the
+# initial uniform grid and total number of phase steps (the grid is refined
+# where the steady state changes fast), and duration of the simulation (in
+# number of T1) before reaching the steady state
+tiers = {
+    "draft": {
+        "threshold": 1e-2, "initial_phase_steps": 9, "phase_steps": 25, 
+        "duration": 3},
+    "standard": {
+        "threshold": 1e-3, "initial_phase_steps": 19, "phase_steps": 60, 
+        "duration": 4},
+    "precise": {
+        "threshold": 1e-4, "initial_phase_steps": 37, "phase_steps": 150, 
+        "duration": 5},
+}
+
+# Smallest interval between two phase steps, in degrees
+min_phase_step_interval = 0.25
+
+# Curves of the pinned configurations: figure, results used as x and y
+overlays = [("magnitude_plot", "phase_steps", "magnitude")]
+
 def create_contents():
     # Species controls
     T1 = bokeh.models.Slider(
@@ -68,6 +102,8 @@ def create_contents():
             bokeh.models.Div(text="Sequence", css_classes=["group-title"]),
             flip_angle, TE, TR,
             css_classes=["box"]),
+        sessions.create_accuracy_controls(update),
+        sessions.create_comparison_controls(__name__, [magnitude_plot]),
         bokeh.models.Div(id="runtime", text="Runtime: ", align="start"),
         width=320, height=250,
         sizing_mode="fixed")
@@ -78,48 +114,43 @@ def create_contents():
         sizing_mode="scale_both")
 
 def update():
-    start = time.time()
+    sessions.update(__name__, display, 3)
+
+def display(document, result):
+    magnitude_data = document.get_model_by_id("magnitude_data")
+    magnitude_data.data = {
+        "x": result["phase_steps"], 
+        "y": result["magnitude"] }
     
+    ideal_spoiling_data = document.get_model_by_id("ideal_spoiling_data")
+    ideal_spoiling_data.data = {
+        "x": (result["phase_steps"][0], result["phase_steps"][-1]), 
+        "y": (result["ideal_spoiling"], result["ideal_spoiling"]) }
+
+def simulate(
+        T1, T2, flip_angle, TE, TR, 
+        threshold=1e-3, initial_phase_steps=19, phase_steps=60, duration=4):
     slice_thickness = 1*mm
     
-    document = bokeh.plotting.curdoc()
-    
-    T1 = document.get_model_by_id("T1").value*ms
-    T2 = document.get_model_by_id("T2").value*ms
-    
-    flip_angle = document.get_model_by_id("flip_angle").value*deg
-    TE = document.get_model_by_id("TE").value*ms
-    TR = document.get_model_by_id("TR").value*ms
-    
     species = sycomore.Species(T1, T2)
-    repetitions = int(4*species.T1/TR)
-    
-    phase_steps = sycomore.linspace(0*deg, 180*deg, 100)
+    repetitions = int(duration*species.T1/TR)
     
-    steady_states = []
-    for phase_step in phase_steps:
+    def steady_state(phase_step):
         model = sycomore.epg.Regular(species)
-        model.threshold = 1e-3
-        steady_state = rf_spoiling(
-                model,
-                flip_angle, TE, TR, slice_thickness, phase_step, repetitions
-            )[-1]
-        steady_states.append(steady_state)
+        model.threshold = threshold
+        echoes = rf_spoiling(
+            model,
+            flip_angle, TE, TR, slice_thickness, phase_step*deg, repetitions)
+        return numpy.abs(echoes[-1])
     
-    magnitude_data = document.get_model_by_id("magnitude_data")
-    magnitude_data.data = {
-        "x": [x.convert_to(deg) for x in phase_steps], 
-        "y": [numpy.abs(x) for x in steady_states] }
-    
-    ideal_spoiling = compute_ideal_spoiling(species, flip_angle, TR)
-    ideal_spoiling_data = document.get_model_by_id("ideal_spoiling_data")
-    ideal_spoiling_data.data = {
-        "x": (phase_steps[0].convert_to(deg), phase_steps[-1].convert_to(deg)), 
-        "y": (ideal_spoiling, ideal_spoiling) }
+    phase_steps, steady_states = utils.sample_adaptively(
+        steady_state, 0, 180, initial_phase_steps, phase_steps, 
+        min_phase_step_interval)
     
-    stop = time.time()
-    document.get_model_by_id("runtime").text = "Runtime: {}".format(
-        utils.to_eng_string(stop-start, "s", 3))
+    return {
+        "phase_steps": phase_steps,
+        "magnitude": steady_states,
+        "ideal_spoiling": compute_ideal_spoiling(species, flip_angle, TR) }
 
 def init():
     update()
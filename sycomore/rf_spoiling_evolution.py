@@ -1,5 +1,3 @@
-import time
-
 import bokeh.layouts
 import bokeh.models
 import bokeh.plotting
@@ -8,10 +6,34 @@ import sycomore
 from sycomore.units import *
 
 from rf_spoiling import *
-import utils
+import sessions
 
 title = "RF-Spoiling (evolution)"
 
+# Simulation parameters: default value and unit of the controls
+parameters = {
+    "T1": (1000, ms), "T2": (1000, ms),
+    "flip_angle": (30, deg), "TE": (5, ms), "TR": (25, ms), 
+    "phase_step": (0, deg),
+}
+
+# Range of the controls: start, end and whether the values are integers
+ranges = {
+    "T1": (0, 2000, False), "T2": (0, 2000, False),
+    "flip_angle": (0, 90, False), "TE": (0, 2000, False),
+    "TR": (0, 2000, False), "phase_step": (0, 180, False),
+}
+
+# Accuracy tiers: threshold of the EPG model
+tiers = {
+    "draft": {"threshold": 1e-2},
+    "standard": {"threshold": 1e-3},
+    "precise": {"threshold": 1e-5},
+}
+
+# Curves of the pinned configurations: figure, results used as x and y
+overlays = [("magnitude_plot", "repetitions", "magnitude")]
+
 def create_contents():
     # Species controls
     T1 = bokeh.models.Slider(
@@ -71,6 +93,8 @@ def create_contents():
             bokeh.models.Div(text="Sequence", css_classes=["group-title"]),
             flip_angle, TE, TR, phase_step,
             css_classes=["box"]),
+        sessions.create_accuracy_controls(update),
+        sessions.create_comparison_controls(__name__, [magnitude_plot]),
         bokeh.models.Div(id="runtime", text="Runtime: ", align="start"),
         width=320, height=250,
         sizing_mode="fixed")
@@ -81,43 +105,35 @@ def create_contents():
         sizing_mode="scale_both")
 
 def update():
-    start = time.time()
+    sessions.update(__name__, display, 1)
+
+def display(document, result):
+    magnitude_data = document.get_model_by_id("magnitude_data")
+    magnitude_data.data = {
+        "x": result["repetitions"], 
+        "y": result["magnitude"] }
     
+    ideal_spoiling_data = document.get_model_by_id("ideal_spoiling_data")
+    ideal_spoiling_data.data = {
+        "x": (0, len(result["repetitions"])), 
+        "y": (result["ideal_spoiling"], result["ideal_spoiling"]) }
+
+def simulate(T1, T2, flip_angle, TE, TR, phase_step, threshold=1e-3):
     slice_thickness = 1*mm
     
-    document = bokeh.plotting.curdoc()
-    
-    T1 = document.get_model_by_id("T1").value*ms
-    T2 = document.get_model_by_id("T2").value*ms
-    
-    flip_angle = document.get_model_by_id("flip_angle").value*deg
-    TE = document.get_model_by_id("TE").value*ms
-    TR = document.get_model_by_id("TR").value*ms
-    phase_step = document.get_model_by_id("phase_step").value*deg
-    
     species = sycomore.Species(T1, T2)
     model = sycomore.epg.Regular(species)
-    model.threshold = 1e-3
+    model.threshold = threshold
     
     repetitions = int(4*species.T1/TR)
     
     echoes = rf_spoiling(
         model, flip_angle, TE, TR, slice_thickness, phase_step, repetitions)
     
-    magnitude_data = document.get_model_by_id("magnitude_data")
-    magnitude_data.data = {
-        "x": range(repetitions), 
-        "y": numpy.abs(echoes) }
-    
-    ideal_spoiling = compute_ideal_spoiling(species, flip_angle, TR)
-    ideal_spoiling_data = document.get_model_by_id("ideal_spoiling_data")
-    ideal_spoiling_data.data = {
-        "x": (0, repetitions), 
-        "y": (ideal_spoiling, ideal_spoiling) }
-    
-    stop = time.time()
-    document.get_model_by_id("runtime").text = "Runtime: {}".format(
-        utils.to_eng_string(stop-start, "s", 1))
+    return {
+        "repetitions": numpy.arange(repetitions),
+        "magnitude": numpy.abs(echoes),
+        "ideal_spoiling": compute_ideal_spoiling(species, flip_angle, TR) }
 
 def init():
     update()
@@ -1,5 +1,3 @@
-import time
-
 import bokeh.layouts
 import bokeh.models
 import bokeh.palettes
@@ -8,7 +6,7 @@ import numpy
 import sycomore
 from sycomore.units import *
 
-import utils
+import sessions
 
 title = "Spin echo contrasts"
 
@@ -21,6 +19,30 @@ presets = {
     "PD-weighted": (10*ms, 3000*ms),
 }
 
+# Simulation parameters: default value and unit of the controls
+parameters = {
+    "excitation": (90, deg), "TE": (10, ms), "refocalization": (180, deg), 
+    "TR": (600, ms),
+}
+
+# Range of the controls: start, end and whether the values are integers
+ranges = {
+    "excitation": (0, 180, False), "TE": (0, 200, False),
+    "refocalization": (0, 180, False), "TR": (0, 3000, False),
+}
+
+# Accuracy tiers: threshold of the EPG model, number of T1 and T2 samples, and
+# number of repetitions before reaching the steady state
+tiers = {
+    "draft": {"threshold": 1e-2, "samples": 10, "repetitions": 30},
+    "standard": {"threshold": 1e-3, "samples": 20, "repetitions": 150},
+    "precise": {"threshold": 1e-4, "samples": 50, "repetitions": 300},
+}
+
+# Curves of the pinned configurations: figure, results used as x and y
+overlays = [
+    ("T1_plot", "T1", "T1_signal"), ("T2_plot", "T2", "T2_signal")]
+
 def create_contents():
     default_contrast = "T1-weighted"
     default_TE, default_TR = [
@@ -86,6 +108,8 @@ def create_contents():
             bokeh.models.Div(text="Sequence", css_classes=["group-title"]),
             excitation, TE, refocalization, TR, preset,
             css_classes=["box"]),
+        sessions.create_accuracy_controls(update),
+        sessions.create_comparison_controls(__name__, [T1_plot, T2_plot]),
         bokeh.models.Div(id="runtime", text="Runtime: ", align="start"),
         width=320, height=250,
         sizing_mode="fixed")
@@ -96,40 +120,37 @@ def create_contents():
         sizing_mode="scale_both")
 
 def update():
-    start = time.time()
-    
-    document = bokeh.plotting.curdoc()
-    
-    excitation = document.get_model_by_id("excitation").value*deg
-    TE = document.get_model_by_id("TE").value*ms
-    refocalization = document.get_model_by_id("refocalization").value*deg
-    TR = document.get_model_by_id("TR").value*ms
+    sessions.update(__name__, display, 1)
+
+def display(document, result):
+    T1_data = document.get_model_by_id("T1_data")
+    T1_data.data = { "x": result["T1"], "y": result["T1_signal"] }
     
-    T1_array = sycomore.linspace(0*s, 1*s, 20)
-    T2_array = sycomore.linspace(0*s, 1*s, 20)
+    T2_data = document.get_model_by_id("T2_data")
+    T2_data.data = { "x": result["T2"], "y": result["T2_signal"] }
+
+def simulate(
+        excitation, TE, refocalization, TR, 
+        threshold=1e-3, samples=20, repetitions=150):
+    T1_array = sycomore.linspace(0*s, 1*s, samples)
+    T2_array = sycomore.linspace(0*s, 1*s, samples)
     
     T1_signal = [
         simulate_spin_echo(
             sycomore.Species(T1, fixed_T2),
-            excitation, TE, refocalization, TR)
+            excitation, TE, refocalization, TR, threshold, repetitions)
         for T1 in T1_array]
     T2_signal = [
         simulate_spin_echo(
             sycomore.Species(fixed_T1, T2),
-            excitation, TE, refocalization, TR)
+            excitation, TE, refocalization, TR, threshold, repetitions)
         for T2 in T2_array]
     
-    T1_data = document.get_model_by_id("T1_data")
-    T1_data.data = {
-        "x": [x.convert_to(ms) for x in T1_array], "y": numpy.abs(T1_signal) }
-    
-    T2_data = document.get_model_by_id("T2_data")
-    T2_data.data = {
-        "x": [x.convert_to(ms) for x in T2_array], "y": numpy.abs(T2_signal) }
-    
-    stop = time.time()
-    document.get_model_by_id("runtime").text = "Runtime: {}".format(
-        utils.to_eng_string(stop-start, "s", 1))
+    return {
+        "T1": numpy.array([x.convert_to(ms) for x in T1_array]), 
+        "T1_signal": numpy.abs(T1_signal),
+        "T2": numpy.array([x.convert_to(ms) for x in T2_array]), 
+        "T2_signal": numpy.abs(T2_signal) }
 
 def set_preset():
     document = bokeh.plotting.curdoc()
@@ -138,12 +159,14 @@ def set_preset():
     document.get_model_by_id("TR").value = TR.convert_to(ms)
     update()
 
-def simulate_spin_echo(species, excitation, TE, refocalization, TR):
+def simulate_spin_echo(
+        species, excitation, TE, refocalization, TR, 
+        threshold=1e-3, repetitions=150):
     model = sycomore.epg.Discrete(species)
-    model.threshold = 1e-3
+    model.threshold = threshold
     signal = 0
     gradient = sycomore.TimeInterval(TE/2, 1*mT/m)
-    for i in range(150):
+    for i in range(repetitions):
         model.apply_pulse(excitation)
         model.apply_time_interval(gradient)
         model.apply_pulse(refocalization)
@@ -0,0 +1,89 @@
+""" Serve the Bokeh application and the HTTP API of the simulations.
+"""
+
+import argparse
+import logging
+import pathlib
+
+import bokeh.application
+import bokeh.application.handlers
+import bokeh.server.server
+import bokeh.util.logconfig
+import tornado.ioloop
+
+import api
+import sessions
+
+here = pathlib.Path(__file__).parent
+
+# Route of the application, as served by "bokeh serve" from the sycomore
+# directory; the root redirects to it
+route = "/sycomore"
+
+logger = logging.getLogger(__name__)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--address", default="localhost")
+    parser.add_argument("--port", type=int, default=5006)
+    parser.add_argument(
+        "--allow-websocket-origin", action="append", default=[],
+        dest="allow_websocket_origin", metavar="HOST[:PORT]")
+    parser.add_argument("--use-xheaders", action="store_true")
+    parser.add_argument(
+        "--log-level", default="info",
+        choices=["debug", "info", "warning", "error", "critical"],
+        help="Level of the logs (default: %(default)s)")
+    parser.add_argument(
+        "--idle-timeout", type=float, default=600,
+        help="Drop the data of hidden or disconnected sessions idle for this "
+            "duration, in seconds "
+            "(default: %(default)s)")
+    parser.add_argument(
+        "--eviction-min-size", type=int, default=64*1024,
+        help="Only drop the data of sessions holding at least this size, in "
+            "bytes (default: %(default)s)")
+    parser.add_argument(
+        "--eviction-period", type=float, default=60,
+        help="Period of the check of idle sessions, in seconds (default: "
+            "%(default)s)")
+    parser.add_argument(
+        "--unused-session-lifetime", type=float, default=10,
+        help="Lifetime of the sessions without connection, in seconds "
+            "(default: %(default)s)")
+    parser.add_argument(
+        "--check-unused-sessions", type=float, default=5,
+        help="Period of the check of unused sessions, in seconds (default: "
+            "%(default)s)")
+    arguments = parser.parse_args()
+
+    bokeh.util.logconfig.basicConfig(
+        format="%(asctime)s %(message)s",
+        level=getattr(logging, arguments.log_level.upper()))
+
+    application = bokeh.application.Application(
+        bokeh.application.handlers.DirectoryHandler(filename=str(here)))
+    server = bokeh.server.server.Server(
+        {route: application},
+        address=arguments.address, port=arguments.port,
+        allow_websocket_origin=(
+            arguments.allow_websocket_origin
+            or ["{}:{}".format(arguments.address, arguments.port)]),
+        use_xheaders=arguments.use_xheaders,
+        extra_patterns=api.patterns,
+        unused_session_lifetime_milliseconds=(
+            1000*arguments.unused_session_lifetime),
+        check_unused_sessions_milliseconds=(
+            1000*arguments.check_unused_sessions))
+    tornado.ioloop.PeriodicCallback(
+        lambda: sessions.evict_idle(
+            arguments.idle_timeout, arguments.eviction_min_size),
+        1000*arguments.eviction_period).start()
+    server.start()
+    logger.info(
+        "Bokeh app running at: http://%s:%d%s",
+        arguments.address, arguments.port, route)
+    server.io_loop.start()
+
+if __name__ == "__main__":
+    main()
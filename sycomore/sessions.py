@@ -0,0 +1,376 @@
+import concurrent.futures
+import functools
+import logging
+import sys
+import time
+import weakref
+
+import bokeh.layouts
+import bokeh.models
+import bokeh.palettes
+import bokeh.plotting
+import numpy
+
+import profiling
+import simulation
+import utils
+
+# Threads running the background computations, e.g. the refinement of a draft
+executor = concurrent.futures.ThreadPoolExecutor(simulation.workers)
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of pinned configurations, and their colors
+max_pins = 4
+pin_colors = bokeh.palettes.Category10_10[2:2+max_pins]
+
+class Session(object):
+    """ Server-side state of a session, beyond its document
+    """
+
+    def __init__(self, id, experiment):
+        self.id = id
+        self.experiment = experiment
+        # Incremented at each update, so that obsolete refinements are dropped
+        self.generation = 0
+        # Future of the pending refinement, cancelled by the next update
+        self.refinement = None
+        # Number of the next updates to profile
+        self.profiles = 0
+        # Time of the last update or of the last change of visibility
+        self.last_activity = time.time()
+        # Whether the page is visible, as reported by the page
+        self.visible = True
+        # Whether the data of the document was dropped
+        self.evicted = False
+        # Pinned configurations, displayed along with the current one
+        self.pins = []
+
+class Pin(object):
+    """ Pinned configuration of an experiment, and its results for each tier
+    """
+
+    def __init__(self, values, tier, results):
+        self.values = values
+        self.results = {tier: results}
+
+    def get_results(self, tier):
+        """ Return the results for the tier, or for another tier if they are
+            not yet computed, or None
+        """
+
+        if tier in self.results:
+            return self.results[tier]
+        else:
+            return next(iter(self.results.values()), None)
+
+    def get_memory(self):
+        return sum(
+            numpy.asarray(x).nbytes
+            for results in list(self.results.values())
+            for x in results.values())
+
+_sessions = weakref.WeakKeyDictionary()
+
+def get_session(document, experiment):
+    if document not in _sessions:
+        _sessions[document] = Session(document.session_context.id, experiment)
+        document.on_session_destroyed(
+            lambda session_context: _sessions.pop(document, None))
+    return _sessions[document]
+
+def watch_activity(document, experiment, update):
+    """ Add an invisible model to the document, which the page updates when it
+        is hidden or shown again (cf. templates/index.html): the data of an
+        evicted session is restored when it is shown.
+    """
+
+    session = get_session(document, experiment)
+
+    def on_activity(attr, old, new):
+        session.last_activity = time.time()
+        session.visible = (new[0] == "visible") if new else True
+        if session.visible and session.evicted:
+            update()
+
+    activity = bokeh.models.Div(id="activity", visible=False)
+    activity.on_change("tags", on_activity)
+    document.add_root(activity)
+
+def create_comparison_controls(experiment, figures):
+    """ Create the controls pinning the current configuration, and the curves
+        of the pinned configurations in the figures, as described by the
+        "overlays" of the experiment
+    """
+
+    module = simulation.get_experiment(experiment)
+    figures = {x.id: x for x in figures}
+    for figure, _, y in module.overlays:
+        for index, color in enumerate(pin_colors):
+            source = bokeh.models.ColumnDataSource(
+                id="{}_{}_pin_{}".format(figure, y, index),
+                data={"x": [], "y": []})
+            figures[figure].line(
+                x="x", y="y", source=source, color=color, line_dash="dashed")
+
+    pin = bokeh.models.Button(label="Pin current curve")
+    pin.on_click(lambda: pin_current(experiment))
+    clear = bokeh.models.Button(label="Clear pinned curves")
+    clear.on_click(lambda: clear_pins(experiment))
+    return bokeh.layouts.column(
+        bokeh.models.Div(text="Comparison", css_classes=["group-title"]),
+        bokeh.layouts.row(pin, clear),
+        bokeh.models.Div(id="pins", text=""),
+        css_classes=["box"])
+
+def pin_current(experiment):
+    document = bokeh.plotting.curdoc()
+    session = get_session(document, experiment)
+    values, tier = get_configuration(document, experiment)
+    session.pins.append(
+        Pin(values, tier, simulation.compute(experiment, values, tier)))
+    del session.pins[:-max_pins]
+    display_pins(document, session, values, tier)
+
+def clear_pins(experiment):
+    document = bokeh.plotting.curdoc()
+    session = get_session(document, experiment)
+    session.pins = []
+    display_pins(document, session, *get_configuration(document, experiment))
+
+def display_pins(document, session, values, tier):
+    """ Display the pinned results and their parameters which differ from the
+        current ones
+    """
+
+    module = simulation.get_experiment(session.experiment)
+    for index in range(max_pins):
+        results = (
+            session.pins[index].get_results(tier)
+            if index < len(session.pins) else None)
+        for figure, x, y in module.overlays:
+            source = document.get_model_by_id(
+                "{}_{}_pin_{}".format(figure, y, index))
+            source.data = (
+                {"x": results[x], "y": results[y]} if results is not None
+                else {"x": [], "y": []})
+
+    descriptions = []
+    for pin, color in zip(session.pins, pin_colors):
+        differences = [
+            "{}={}".format(name, value) for name, value in pin.values.items()
+            if value != values[name]]
+        descriptions.append(
+            "<span style=\"color: {}\">&#9632;</span> {}".format(
+                color, ", ".join(differences) or "current parameters"))
+    document.get_model_by_id("pins").text = "<br>".join(descriptions)
+
+def get_memory(document):
+    """ Return the approximate size in bytes of the data sources of a document
+    """
+
+    size = 0
+    for source in document.select({"type": bokeh.models.ColumnDataSource}):
+        for column in source.data.values():
+            if isinstance(column, numpy.ndarray):
+                size += column.nbytes
+            else:
+                size += sys.getsizeof(column) + sum(
+                    sys.getsizeof(x) for x in column)
+    return size
+
+def get_metrics():
+    """ Return the memory usage and the activity of the sessions
+    """
+
+    # Do not expose the ids of the sessions, which give access to them
+    now = time.time()
+    sessions = [
+        {
+            "index": index, "experiment": session.experiment,
+            "idle": now-session.last_activity, "visible": session.visible,
+            "connected": is_connected(document), "evicted": session.evicted,
+            "bytes": get_memory(document), 
+            "pins": len(session.pins),
+            "pins_bytes": sum(x.get_memory() for x in session.pins)}
+        for index, (document, session) in enumerate(list(_sessions.items()))]
+    return {
+        "sessions": sessions,
+        "sessions_bytes": sum(x["bytes"]+x["pins_bytes"] for x in sessions),
+        "cache": simulation.get_cache_metrics()}
+
+def is_connected(document):
+    server_session = document.session_context.session
+    return server_session is not None and server_session.connection_count > 0
+
+def evict_idle(idle_timeout, min_size):
+    """ Drop the data of the sessions which are hidden or without connection,
+        idle for more than idle_timeout seconds and holding at least min_size
+        bytes. The data is restored (usually from the cache) by the next
+        update.
+    """
+
+    now = time.time()
+    for document, session in list(_sessions.items()):
+        if (
+                not session.evicted
+                and (not session.visible or not is_connected(document))
+                and now-session.last_activity > idle_timeout
+                and get_memory(document)
+                    + sum(x.get_memory() for x in session.pins) >= min_size):
+            session.evicted = True
+            document.add_next_tick_callback(
+                functools.partial(_evict, document, session))
+
+def _evict(document, session):
+    # The session may have been updated since the eviction was scheduled
+    if not session.evicted:
+        return
+    for source in document.select({"type": bokeh.models.ColumnDataSource}):
+        source.data = {name: [] for name in source.data}
+    for pin in session.pins:
+        pin.results.clear()
+    logger.info("Evicted data of idle session %s", session.id)
+
+def create_accuracy_controls(update):
+    """ Create the controls of the accuracy tier of an experiment
+    """
+
+    tier = bokeh.models.Select(
+        id="tier", title="Accuracy", options=simulation.tiers,
+        value=simulation.default_tier)
+    progressive = bokeh.models.CheckboxGroup(
+        id="progressive", labels=["Show draft while refining"], active=[0])
+    tier.on_change("value", lambda attr, old, new: update())
+    return bokeh.layouts.column(
+        bokeh.models.Div(text="Accuracy", css_classes=["group-title"]),
+        tier, progressive,
+        css_classes=["box"])
+
+def update(experiment, display, decimals=None):
+    """ Simulate the experiment with the parameters of the current document,
+        and display the results. If the experiment has accuracy tiers, a draft
+        may be displayed first and refined in the background.
+    """
+
+    document = bokeh.plotting.curdoc()
+    session = get_session(document, experiment)
+    session.generation += 1
+    session.last_activity = time.time()
+    session.evicted = False
+    if session.refinement is not None:
+        session.refinement.cancel()
+        session.refinement = None
+
+    values, tier = get_configuration(document, experiment)
+    progressive = (
+        tier is not None
+        and document.get_model_by_id("progressive").active
+        and tier != "draft"
+        and (
+            not simulation.is_cached(experiment, values, tier)
+            or any(tier not in x.results for x in session.pins)))
+
+    start = time.time()
+    if session.profiles > 0:
+        # Profile the full simulation, bypassing the cache and the draft, and
+        # cache its results so that only the missing pins are computed
+        session.profiles -= 1
+        simulation.store(
+            experiment, values, tier,
+            profiling.profile(experiment, values, tier, profiling.directory)[0])
+        display(document, compute(experiment, session, values, tier))
+        display_pins(document, session, values, tier)
+        set_runtime(document, session, time.time()-start, tier, decimals)
+    elif progressive:
+        display(document, simulation.compute(experiment, values, "draft"))
+        display_pins(document, session, values, tier)
+        set_runtime(
+            document, session, time.time()-start,
+            "draft, refining to {}".format(tier), decimals, False)
+
+        future = executor.submit(
+            _compute_refinement, experiment, session, session.generation,
+            values, tier)
+        session.refinement = future
+        refine = functools.partial(
+            _refine, document, session, session.generation, display, start,
+            values, tier, decimals)
+        future.add_done_callback(
+            lambda future: document.add_next_tick_callback(
+                functools.partial(refine, future)))
+    else:
+        display(document, compute(experiment, session, values, tier))
+        display_pins(document, session, values, tier)
+        set_runtime(document, session, time.time()-start, tier, decimals)
+
+def get_configuration(document, experiment):
+    """ Return the values of the parameters of the document, and its tier
+    """
+
+    module = simulation.get_experiment(experiment)
+    values = {
+        name: document.get_model_by_id(name).value
+        for name in module.parameters}
+    tier = (
+        document.get_model_by_id("tier").value if hasattr(module, "tiers")
+        else None)
+    return values, tier
+
+def compute(experiment, session, values, tier, inline=True):
+    """ Compute the results of the current configuration and the missing
+        results of the pinned configurations in a single call
+    """
+
+    pins = [x for x in session.pins if tier not in x.results]
+    results = simulation.compute_many(
+        experiment, [values]+[x.values for x in pins], tier, inline)
+    for pin, pin_results in zip(pins, results[1:]):
+        pin.results[tier] = pin_results
+    return results[0]
+
+def _compute_refinement(experiment, session, generation, values, tier):
+    # Skip the refinement if the parameters changed before it started, and
+    # keep the simulation out of this thread, which shares the GIL with the
+    # event loop of the server
+    if session.generation != generation:
+        return None
+    return compute(experiment, session, values, tier, inline=False)
+
+def _refine(
+        document, session, generation, display, start, values, tier, decimals,
+        future):
+    # Drop the refinement if the parameters changed in the meantime
+    if session.generation != generation or future.cancelled():
+        return
+    session.refinement = None
+    try:
+        results = future.result()
+    except Exception as e:
+        logger.exception("Refinement of %s failed", session.experiment)
+        set_error(document, session, tier, e)
+        return
+    display(document, results)
+    display_pins(document, session, values, tier)
+    set_runtime(document, session, time.time()-start, tier, decimals)
+
+def set_runtime(document, session, duration, tier, decimals, final=True):
+    """ Display the runtime, and tag it with the update it belongs to and
+        whether it is final (i.e. not a draft) so that clients can wait for it
+    """
+
+    text = "Runtime: {}".format(utils.to_eng_string(duration, "s", decimals))
+    if tier is not None:
+        text += " ({})".format(tier)
+    runtime = document.get_model_by_id("runtime")
+    runtime.text = text
+    runtime.tags = [session.generation, final]
+
+def set_error(document, session, tier, error):
+    """ Display the error of a simulation in place of the runtime, as the final
+        state of the update
+    """
+
+    runtime = document.get_model_by_id("runtime")
+    runtime.text = "Simulation failed ({}): {}".format(tier, error)
+    runtime.tags = [session.generation, True]
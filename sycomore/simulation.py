@@ -0,0 +1,214 @@
+import collections
+import concurrent.futures
+import concurrent.futures.process
+import importlib
+import math
+import multiprocessing
+import numbers
+import os
+import threading
+
+import numpy
+
+# Experiments which can be simulated outside of a Bokeh document, i.e. which
+# define "parameters" and "simulate"
+experiments = [
+    "rare", "rf_spoiling_evolution", "rf_spoiling_efficiency", "se_contrast",
+    "slice_profile"]
+
+# Accuracy tiers of the experiments which define "tiers", i.e. the settings of
+# their simulation (EPG threshold, sampling density, etc.) for each tier
+tiers = ["draft", "standard", "precise"]
+default_tier = "standard"
+
+# Maximum number of results kept in the cache, shared by all sessions and by
+# the HTTP API
+cache_size = int(os.environ.get("SYCOMORE_CACHE_SIZE", 256))
+
+# Number of processes used to simulate several configurations at once
+workers = int(os.environ.get("SYCOMORE_WORKERS", os.cpu_count()))
+
+_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_experiment(name):
+    """ Return the module of a simulated experiment
+    """
+
+    if name not in experiments:
+        raise KeyError("Unknown experiment: {}".format(name))
+    return importlib.import_module(name)
+
+def get_values(experiment, values):
+    """ Return the values of all parameters of an experiment, expressed in the
+        unit of the controls. Missing values are set to their default.
+    """
+
+    module = get_experiment(experiment)
+    unknown = set(values) - set(module.parameters)
+    if unknown:
+        raise ValueError(
+            "Unknown parameters for {}: {}".format(
+                experiment, ", ".join(sorted(unknown))))
+    return {
+        name: values.get(name, default)
+        for name, (default, _) in module.parameters.items()}
+
+def check_values(experiment, values):
+    """ Check that the values of the parameters are numbers within the range
+        of the controls, and integers for the integer controls. Return the
+        values of all parameters.
+    """
+
+    module = get_experiment(experiment)
+    values = get_values(experiment, values)
+    for name, value in values.items():
+        start, end, integer = module.ranges[name]
+        if (
+                not isinstance(value, numbers.Real) or isinstance(value, bool)
+                or not math.isfinite(value)):
+            raise ValueError("Invalid value for {}: {}".format(name, value))
+        elif not start <= value <= end:
+            raise ValueError(
+                "Value of {} must be between {} and {}: {}".format(
+                    name, start, end, value))
+        elif integer and not float(value).is_integer():
+            raise ValueError(
+                "Value of {} must be an integer: {}".format(name, value))
+    return values
+
+def get_parameters(experiment, values):
+    """ Convert the values of the parameters, expressed in the unit of the
+        controls, to quantities. Missing values are set to their default.
+    """
+
+    module = get_experiment(experiment)
+    return {
+        name: value*module.parameters[name][1]
+        for name, value in get_values(experiment, values).items()}
+
+def get_tier(experiment, tier):
+    """ Return the accuracy tier of an experiment (None if the experiment has
+        no tiers), using the default tier if none is given
+    """
+
+    module = get_experiment(experiment)
+    if not hasattr(module, "tiers"):
+        return None
+    elif tier is None:
+        return default_tier
+    elif tier not in module.tiers:
+        raise ValueError("Unknown accuracy tier: {}".format(tier))
+    else:
+        return tier
+
+def run(experiment, values, tier=None):
+    """ Simulate an experiment, with parameters expressed in the unit of the
+        controls, and return the dictionary of results
+    """
+
+    module = get_experiment(experiment)
+    tier = get_tier(experiment, tier)
+    settings = module.tiers[tier] if tier is not None else {}
+    return module.simulate(**get_parameters(experiment, values), **settings)
+
+def compute(experiment, values, tier=None, inline=True):
+    """ Simulate an experiment or return its cached results
+    """
+
+    return compute_many(experiment, [values], tier, inline)[0]
+
+def compute_many(experiment, values, tier=None, inline=True):
+    """ Simulate an experiment for a list of configurations, re-using cached
+        results. The missing configurations are simulated in parallel; a
+        single missing configuration is simulated in the calling process,
+        unless inline is False.
+    """
+
+    keys = [get_key(experiment, x, tier) for x in values]
+    with _cache_lock:
+        results = {key: _cache[key] for key in keys if key in _cache}
+        for key in results:
+            _cache.move_to_end(key)
+
+    missing = {
+        key: configuration for key, configuration in zip(keys, values)
+        if key not in results}
+    if len(missing) == 1 and inline:
+        key, configuration = missing.popitem()
+        results[key] = run(experiment, configuration, tier)
+    elif missing:
+        executor = get_executor()
+        try:
+            results.update(zip(
+                missing,
+                executor.map(
+                    run, [experiment]*len(missing), missing.values(),
+                    [tier]*len(missing))))
+        except concurrent.futures.process.BrokenProcessPool:
+            # A worker died (e.g. killed when out of memory): replace the pool
+            # for the next calls
+            reset_executor(executor)
+            raise
+
+    with _cache_lock:
+        for key in keys:
+            _insert(key, results[key])
+
+    return [results[key] for key in keys]
+
+def store(experiment, values, tier, results):
+    """ Add the results of a configuration simulated outside of this module,
+        e.g. by the profiler, to the cache
+    """
+
+    key = get_key(experiment, values, tier)
+    with _cache_lock:
+        _insert(key, results)
+
+def _insert(key, results):
+    # Must be called with the lock of the cache held
+    _cache[key] = results
+    _cache.move_to_end(key)
+    while len(_cache) > cache_size:
+        _cache.popitem(last=False)
+
+def get_cache_metrics():
+    with _cache_lock:
+        return {
+            "entries": len(_cache), "capacity": cache_size,
+            "bytes": sum(
+                numpy.asarray(x).nbytes
+                for results in _cache.values() for x in results.values())}
+
+def is_cached(experiment, values, tier=None):
+    with _cache_lock:
+        return get_key(experiment, values, tier) in _cache
+
+def get_key(experiment, values, tier=None):
+    values = get_values(experiment, values)
+    return (
+        experiment, get_tier(experiment, tier),
+        tuple((name, float(x)) for name, x in values.items()))
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Do not fork the server process, which runs an event loop and
+            # threads
+            _executor = concurrent.futures.ProcessPoolExecutor(
+                workers, multiprocessing.get_context("spawn"))
+    return _executor
+
+def reset_executor(executor):
+    """ Discard a broken executor, unless it was already replaced
+    """
+
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False)
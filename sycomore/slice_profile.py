@@ -1,5 +1,3 @@
-import time
-
 import bokeh.layouts
 import bokeh.models
 import bokeh.palettes
@@ -8,10 +6,28 @@ import numpy
 import sycomore
 from sycomore.units import *
 
-import utils
+import sessions
 
 title = "Slice profile"
 
+# Simulation parameters: default value and unit of the controls
+parameters = {
+    "T1": (600, ms), "T2": (400, ms),
+    "flip_angle": (90, deg), "duration": (10, ms), "zero_crossings": (10, 1),
+}
+
+# Range of the controls: start, end and whether the values are integers
+ranges = {
+    "T1": (0, 2000, False), "T2": (0, 2000, False),
+    "flip_angle": (0, 90, False), "duration": (1, 20, False),
+    "zero_crossings": (0, 20, True),
+}
+
+# Curves of the pinned configurations: figure, results used as x and y
+overlays = [
+    ("magnitude_plot", "positions", "transversal"), 
+    ("magnitude_plot", "positions", "longitudinal")]
+
 def create_contents():
     # Species controls
     T1 = bokeh.models.Slider(
@@ -71,6 +87,7 @@ def create_contents():
             bokeh.models.Div(text="Pulse", css_classes=["group-title"]),
             flip_angle, duration, zero_crossings,
             css_classes=["box"]),
+        sessions.create_comparison_controls(__name__, [magnitude_plot]),
         bokeh.models.Div(id="runtime", text="Runtime: ", align="start"),
         width=320, height=250,
         sizing_mode="fixed")
@@ -81,21 +98,22 @@ def create_contents():
         sizing_mode="scale_both")
 
 def update():
-    start = time.time()
+    sessions.update(__name__, display, 3)
+
+def display(document, result):
+    transversal_data = document.get_model_by_id("transversal_data")
+    transversal_data.data = { 
+        "x": result["positions"], "y": result["transversal"] }
     
+    longitudinal_data = document.get_model_by_id("longitudinal_data")
+    longitudinal_data.data = { 
+        "x": result["positions"], "y": result["longitudinal"] }
+
+def simulate(T1, T2, flip_angle, duration, zero_crossings):
     slice_thickness = 1*mm
     
-    document = bokeh.plotting.curdoc()
-    
     pulse_support_size = 101
     
-    T1 = document.get_model_by_id("T1").value*ms
-    T2 = document.get_model_by_id("T2").value*ms
-    
-    flip_angle = document.get_model_by_id("flip_angle").value*deg
-    duration = document.get_model_by_id("duration").value*ms
-    zero_crossings = document.get_model_by_id("zero_crossings").value
-
     t0 = duration/(2*zero_crossings)
 
     support = sycomore.linspace(duration, pulse_support_size)
@@ -156,15 +174,10 @@ def update():
     M_transversal = M_transversal[slice_[0]:slice_[1]]
     M_longitudinal = M_longitudinal[slice_[0]:slice_[1]]
     
-    transversal_data = document.get_model_by_id("transversal_data")
-    transversal_data.data = { "x": x_axis, "y": numpy.abs(M_transversal) }
-    
-    longitudinal_data = document.get_model_by_id("longitudinal_data")
-    longitudinal_data.data = { "x": x_axis, "y": numpy.abs(M_longitudinal) }
-    
-    stop = time.time()
-    document.get_model_by_id("runtime").text = "Runtime: {}".format(
-        utils.to_eng_string(stop-start, "s", 3))
+    return {
+        "positions": x_axis, 
+        "transversal": numpy.abs(M_transversal), 
+        "longitudinal": numpy.abs(M_longitudinal) }
 
 def init():
     update()
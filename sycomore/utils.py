@@ -17,3 +17,45 @@ def to_eng_string(value, unit, decimals=None):
     if decimals is not None:
         mantissa = numpy.round(mantissa)
     return "{} {}{}".format(mantissa, prefix, unit)
+
+def sample_adaptively(function, start, stop, initial_count, budget, min_step=0):
+    """ Sample a scalar function on [start, stop], starting from a uniform grid
+        and bisecting the intervals where the function changes fast or bends,
+        until the function has been evaluated budget times. Return the sorted
+        abscissas and the values of the function.
+        
+        Features narrower than the step of the initial grid may be missed.
+    """
+    
+    x = list(numpy.linspace(start, stop, initial_count))
+    y = [function(v) for v in x]
+    while len(x) < budget:
+        scores = get_refinement_scores(numpy.array(x), numpy.array(y))
+        scores[numpy.diff(x) < 2*min_step] = 0
+        index = numpy.argmax(scores)
+        if scores[index] == 0:
+            break
+        
+        middle = 0.5*(x[index]+x[index+1])
+        x.insert(index+1, middle)
+        y.insert(index+1, function(middle))
+    
+    return numpy.array(x), numpy.array(y)
+
+def get_refinement_scores(x, y):
+    """ Score the intervals of a sampled function: the length of the curve on
+        each interval, plus the distance of its ends to the chord joining their
+        neighbours, in normalized coordinates.
+    """
+    
+    dx = numpy.diff(x)/(x[-1]-x[0])
+    y_range = numpy.ptp(y) or 1
+    dy = numpy.diff(y)/y_range
+    
+    bend = numpy.zeros(len(x))
+    t = (x[1:-1]-x[:-2])/(x[2:]-x[:-2])
+    bend[1:-1] = numpy.abs(y[1:-1] - (y[:-2]+t*(y[2:]-y[:-2])))/y_range
+    
+    # Weight the bend by the width of the interval, so that a single sharp
+    # feature does not use the whole budget
+    return numpy.hypot(dx, dy) + numpy.sqrt(dx)*(bend[:-1]+bend[1:])